@@ -0,0 +1,38 @@
+import hashlib
+
+from placement import stable_hash
+
+
+def bucket_of(var_name, buckets):
+    return stable_hash(var_name) % buckets
+
+
+def bucket_digests(site, var_names, buckets):
+    """
+    Merkle-style summary of a site: one digest per bucket over the (variable, version) pairs in it.
+    Two sites with the same digest for a bucket hold the same versions of all its variables.
+    """
+    contents = {}
+    for var_name in sorted(var_names):
+        contents.setdefault(bucket_of(var_name, buckets), []).append("{}:{}".format(var_name, site.vars[var_name]['version']))
+    return {bucket: hashlib.md5(";".join(entries).encode()).hexdigest() for bucket, entries in contents.items()}
+
+
+class CatchUp:
+    """
+    Catch-up state of a recovered site. pending_vars are the replicated variables that are not readable at the
+    site yet, they are compared with a peer a few buckets at a time by DataManager.catch_up_step.
+    """
+    def __init__(self, site, pending_vars, buckets):
+        """
+        CatchUp constructor
+        :param site: the recovered site.
+        :param pending_vars: names of the replicated variables still to be checked.
+        :param buckets: number of buckets of the digests.
+        """
+        self.site = site
+        self.pending_vars = set(pending_vars)
+        self.buckets = buckets
+
+    def __repr__(self):
+        return "CatchUp(site={}, pending_vars={})".format(self.site.idx, sorted(self.pending_vars))
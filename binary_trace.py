@@ -0,0 +1,157 @@
+"""
+Precompiled binary traces: compile a text input file once, then replay it many times without parsing text.
+
+File layout (little endian):
+- header: magic b"RCCT", format version (u16), record size (u16), number of strings (u32), number of records (u32)
+- string table: every interned string (transaction, variable and site names, written values) as a u16 length
+  followed by its utf-8 bytes, padded to a multiple of 8 bytes
+- records: fixed-width (opcode u8, 3 padding bytes, a u32, b u32, c u32), the u32 fields being indices in the
+  string table. MR and MW are a record with the transaction in a and the number of variables in b, followed by one
+  ARG record per variable (variable in b, value in c for MW).
+Comments and empty lines are dropped by the compiler. Replay only prints what the engine prints, not the echo of
+every command that main.py prints.
+"""
+
+import argparse
+import mmap
+import struct
+
+import main
+from datamanager import database
+
+MAGIC = b"RCCT"
+VERSION = 1
+HEADER = struct.Struct("<4sHHII")
+RECORD = struct.Struct("<B3xIII")
+LENGTH = struct.Struct("<H")
+
+BEGIN, READ, WRITE, END, FAIL, RECOVER, DUMP, ADDSITE, REMOVESITE, MREAD, MWRITE, ARG = range(12)
+OPCODES = {"begin": BEGIN, "R": READ, "W": WRITE, "end": END, "fail": FAIL, "recover": RECOVER, "dump": DUMP,
+           "addsite": ADDSITE, "removesite": REMOVESITE}
+
+
+class StringTable:
+    """
+    Interns the strings of a trace, every distinct string gets the next index.
+    """
+    def __init__(self):
+        self.strings = []
+        self.indices = {}
+
+    def intern(self, string):
+        if string not in self.indices:
+            self.indices[string] = len(self.strings)
+            self.strings.append(string)
+        return self.indices[string]
+
+
+def compile_trace(text_file, binary_file):
+    """
+    Compile a text input file into a binary trace.
+    :return: number of records written
+    """
+    table = StringTable()
+    records = []
+    with open(text_file, 'r') as f:
+        for number, line in enumerate(f, 1):
+            command, args = main.parse_command(line)
+            if command in ("comment", "empty"):
+                continue
+            elif command == "unexpected":
+                print("Line {}: unexpected input {}, skipped".format(number, args[0]))
+            elif command == "MR":
+                transaction, variables = args
+                records.append((MREAD, table.intern(transaction), len(variables), 0))
+                records.extend((ARG, 0, table.intern(variable), 0) for variable in variables)
+            elif command == "MW":
+                transaction, writes = args
+                records.append((MWRITE, table.intern(transaction), len(writes), 0))
+                records.extend((ARG, 0, table.intern(variable), table.intern(value)) for variable, value in writes.items())
+            else:
+                fields = [table.intern(arg) for arg in args] + [0] * (3 - len(args))
+                records.append((OPCODES[command], *fields))
+
+    with open(binary_file, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, RECORD.size, len(table.strings), len(records)))
+        size = 0
+        for string in table.strings:
+            data = string.encode()
+            f.write(LENGTH.pack(len(data)) + data)
+            size += LENGTH.size + len(data)
+        f.write(b"\0" * (-size % 8))
+        for record in records:
+            f.write(RECORD.pack(*record))
+    return len(records)
+
+
+def replay_trace(binary_file):
+    """
+    Memory-map a binary trace and feed its operations to the transaction manager and the database.
+    The string table is decoded once, records are then only unpacked and dispatched by opcode.
+    """
+    transaction_manager = main.transaction_manager
+    with open(binary_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        if len(mm) < HEADER.size:
+            raise ValueError("{} is not a version {} binary trace".format(binary_file, VERSION))
+        magic, version, record_size, string_count, record_count = HEADER.unpack_from(mm, 0)
+        if magic != MAGIC or version != VERSION or record_size != RECORD.size:
+            raise ValueError("{} is not a version {} binary trace".format(binary_file, VERSION))
+        offset = HEADER.size
+        strings = []
+        for _ in range(string_count):
+            (length,) = LENGTH.unpack_from(mm, offset)
+            offset += LENGTH.size
+            strings.append(mm[offset:offset + length].decode())
+            offset += length
+        offset += -(offset - HEADER.size) % 8
+
+        handlers = {
+            BEGIN: lambda a, b, c: transaction_manager.handle_begin_transaction(strings[a]),
+            READ: lambda a, b, c: transaction_manager.handle_read(strings[a], strings[b]),
+            WRITE: lambda a, b, c: transaction_manager.handle_write(strings[a], strings[b], strings[c]),
+            END: lambda a, b, c: transaction_manager.handle_end_transaction(strings[a]),
+            FAIL: lambda a, b, c: database.handle_fail_site(strings[a]),
+            RECOVER: lambda a, b, c: database.handle_recover_site(strings[a]),
+            DUMP: lambda a, b, c: database.dump(),
+            ADDSITE: lambda a, b, c: database.add_site(strings[a]),
+            REMOVESITE: lambda a, b, c: database.remove_site(strings[a]),
+        }
+        view = memoryview(mm)[offset:offset + record_count * RECORD.size]
+        records = RECORD.iter_unpack(view)
+        try:
+            for opcode, a, b, c in records:
+                if opcode == MREAD:
+                    variables = [strings[next(records)[2]] for _ in range(b)]
+                    transaction_manager.handle_multi_read(strings[a], variables)
+                elif opcode == MWRITE:
+                    writes = {}
+                    for _ in range(b):
+                        _, _, variable, value = next(records)
+                        writes[strings[variable]] = strings[value]
+                    transaction_manager.handle_multi_write(strings[a], writes)
+                else:
+                    handlers[opcode](a, b, c)
+        except Exception as e:
+            print(f"An error occurred: {e}")
+        finally:
+            del records
+            view.release()
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(usage="python3 binary_trace.py compile <input file> <trace file>\n"
+                                               "       python3 binary_trace.py replay <trace file> [engine options]")
+    subparsers = arg_parser.add_subparsers(dest="action", required=True)
+    compile_parser = subparsers.add_parser("compile")
+    compile_parser.add_argument("input_file")
+    compile_parser.add_argument("trace_file")
+    replay_parser = subparsers.add_parser("replay")
+    replay_parser.add_argument("trace_file")
+    main.add_engine_arguments(replay_parser)
+    args = arg_parser.parse_args()
+
+    if args.action == "compile":
+        print("{} records written to {}".format(compile_trace(args.input_file, args.trace_file), args.trace_file))
+    else:
+        main.configure_engine(args)
+        replay_trace(args.trace_file)
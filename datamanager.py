@@ -1,7 +1,10 @@
+import bisect
 import collections
-from typing import Optional
+from typing import Optional, Tuple
 
 from DependencyGraph import dependency_graph
+from anti_entropy import CatchUp, bucket_digests, bucket_of
+from placement import DefaultPlacement
 from VirtualClock import virtual_clock
 from transaction_manager import TransactionManager
 
@@ -9,6 +12,8 @@ from transaction_manager import TransactionManager
 class DataManager:
     STATUS_UP = "UP"
     STATUS_DOWN = "DOWN"
+    REPLICATION_AVAILABLE_COPIES = "available_copies"
+    REPLICATION_QUORUM = "quorum"
 
     class Var:  # per site
         def __init__(self, idx, sites=[]):
@@ -20,7 +25,9 @@ class DataManager:
             :param committed_version: version. initial or the transaction name.
             :param sites: List of sites that have this variable.
             :param last_write_success: Was the last write for the variable successful.
-            :param read_blocked: Is read blocked for the variable.
+            :param version: Number of commits to the variable, the replica with the highest version is the freshest.
+            :param read_quorum: Number of replicas a read has to reach in quorum mode, None with available copies.
+            :param write_quorum: Number of replicas a write has to reach in quorum mode, None with available copies.
             """
             self.idx = idx
             self.name = "x" + str(idx)
@@ -28,34 +35,74 @@ class DataManager:
             self.committed_version = "initial"  # values can only be committed by the initializer, or by transactions
             self.sites = []
             self.last_write_success = False
-            self.read_blocked = False
+            self.version = 0
+            self.read_quorum = None
+            self.write_quorum = None
 
-        def read_var(self, transaction) -> Optional[int]:
+        def uses_quorum(self):
             """
-            Reads the var from the site(s)
-            :return: value of the var
-            For odd variables:
-            Upon recovery of a site s, all non-replicated variables are available for
-                reads and writes.
-            For even variables:
-            Regarding replicated variables, the site makes them available for writing,
-                but not reading for transactions that begin after the recovery until a commit
-                has happened. In fact, a read from a transaction that begins after the recovery
-                of site s for a replicated variable x will not be allowed at s until a committed 
-                write to x takes place on s
+            Quorum consensus only applies to replicated variables, a single copy is always read and written directly.
+            """
+            return self.write_quorum is not None and len(self.sites) > 1
+
+        def write_sites(self):
             """
+            Sites that a write to this variable goes to.
+            With available copies that is every up site, with quorum consensus write_quorum up sites, starting at an
+            offset that moves with every commit so that the same replicas are not always the ones left behind.
+            The remaining replicas get the value later through the propagation queue of the data manager.
+            """
+            up_sites = [site for site in self.sites if site.status == DataManager.STATUS_UP]
+            if self.uses_quorum() and up_sites:
+                start = self.version % len(up_sites)
+                return (up_sites[start:] + up_sites[:start])[:self.write_quorum]
+            return up_sites
 
-            if self.idx % 2 == 1:
+        def read_quorum_var(self, transaction):
+            """
+            Quorum read of a replicated variable. Every up site that was up for the whole life of the transaction
+            has a valid snapshot. If at least read_quorum of them are available, the value with the highest version among
+            read_quorum of them is returned. Since read_quorum + write_quorum > number of replicas, one of them
+            has the latest write committed before the transaction began.
+            """
+            candidates = []
+            for site in self.sites:
+                if site.up_during(transaction.start_time) and site.last_recovery() < transaction.start_time:
+                    candidates.append(site)
+            if len(candidates) < self.read_quorum:
+                return None, len(candidates)
+            freshest = max(candidates[:self.read_quorum],
+                           key=lambda site: site.vars[self.name]['transaction_versions'][transaction.name])
+            return freshest.vars[self.name]['transaction_snapshots'][transaction.name][0], len(candidates)
+
+        def try_read_var(self, transaction):
+            """
+            Finds a site that can serve the read of the transaction, following the rules described in read_var.
+            Nothing is printed or marked blocked here, so blocked reads can be retried with it.
+            :return: (whether the read could be served, value read)
+            """
+            if self.uses_quorum():
+                val, _ = self.read_quorum_var(transaction)
+                if val is not None:
+                    return True, val
+            elif self.idx % 2 == 1:
                 """
                 Upon recovery of a site s, all non-replicated variables are available for
                 reads and writes.
                 """
                 site = self.sites[0]
-                if site.status == DataManager.STATUS_UP or (site.recovery_history[-1] < transaction.start_time 
-                                                            and transaction.start_time < site.failure_history[-1]):
+                if site.status == DataManager.STATUS_UP or (site.last_recovery() < transaction.start_time
+                                                            and transaction.start_time < site.last_failure()):
                     # as long as the site s up for single replica case, it doesn't matter and it will return
                     # or, if transaction began before the first failure
-                    return site.vars[self.name]['transaction_snapshots'][transaction.name][0]
+                    value = site.vars[self.name]['transaction_snapshots'][transaction.name][0]
+                    if value is None:
+                        # the site was down when the transaction began, its committed value can only be read if it is
+                        # still the one as of then
+                        if site.vars[self.name]['committed_at'] >= transaction.start_time:
+                            return False, None
+                        value = site.vars[self.name]['val']
+                    return True, value
                 
             else:
                 """
@@ -66,23 +113,48 @@ class DataManager:
                 write to x takes place on s
                 """
                 for site in self.sites:
-                    last_recovered = site.recovery_history[-1]
-                    last_failed = site.failure_history[-1] if site.failure_history else 0
+                    last_failed = site.last_failure()
                     if site.status == DataManager.STATUS_UP:
-                        if last_failed < transaction.start_time and last_recovered < transaction.start_time:
-                            # print(transaction.name, transaction.start_time, last_recovered, last_failed, site.idx, site.vars[self.name]['committed_at'], self.name)
-                            # print(site.vars[self.name]['committed_at'], last_recovered, last_failed)
-                            if site.vars[self.name]['committed_at'] > last_recovered and (site.vars[self.name]['committed_at'] < transaction.start_time or last_failed == 0):
-                                return site.vars[self.name]['transaction_snapshots'][transaction.name][0]
+                        committed_at = site.vars[self.name]['committed_at']
+                        snapshot = site.vars[self.name]['transaction_snapshots'].get(transaction.name, (None,))
+                        # the site has to have been up from its last commit before the transaction began until the
+                        # begin, it may have failed and recovered since as the snapshot was taken at the begin
+                        if snapshot[0] is not None and (last_failed == 0 or (
+                                committed_at < transaction.start_time and site.up_during(committed_at, transaction.start_time))):
+                            return True, snapshot[0]
                         continue
-            print("Read failed as none of the sites hosting this var are up")
+            return False, None
+
+        def read_var(self, transaction) -> Tuple[bool, Optional[int]]:
+            """
+            Reads the var from the site(s)
+            :return: (whether the read was served, value of the var)
+            For odd variables:
+            Upon recovery of a site s, all non-replicated variables are available for
+                reads and writes.
+            For even variables:
+            Regarding replicated variables, the site makes them available for writing,
+                but not reading for transactions that begin after the recovery until a commit
+                has happened. In fact, a read from a transaction that begins after the recovery
+                of site s for a replicated variable x will not be allowed at s until a committed 
+                write to x takes place on s
+            """
+
+            served, val = self.try_read_var(transaction)
+            if served:
+                return True, val
+            if self.uses_quorum():
+                _, available = self.read_quorum_var(transaction)
+                print("Read failed as only {}/{} replicas are up, read quorum is {}".format(available, len(self.sites), self.read_quorum))
+            else:
+                print("Read failed as none of the sites hosting this var are up")
             print("{} will abort if not unblocked by recovery of any site".format(transaction.name))
             for site in self.sites:
                 temp = site.vars[self.name]['transaction_snapshots'][transaction.name]
                 site.vars[self.name]['transaction_snapshots'][transaction.name] = (temp[0], temp[1], temp[2], temp[3], True)
                 # print(site.vars[self.name])
             # transaction.read_even_blocked = True
-            return None
+            return False, None
 
         def write_var(self, transaction, val):
             """
@@ -96,21 +168,44 @@ class DataManager:
             The whether update is done to check if we try to write on a failed site and later check whether to abort the transaction for that.
             If atleast one successful write was made we make the write success as True else print an error.
             """
-            self.last_write_success = False
             success_count = 0
+            targets = self.write_sites()
             for site in self.sites:
                 # print(site.status)
-
-                if site.status == DataManager.STATUS_UP:
-                    # value, whether site was updated since T began, update time, update attempt time, read blocked for that transaction
-                    temp = site.vars[self.name]['transaction_snapshots'][transaction]
-                    site.vars[self.name]['transaction_snapshots'][transaction] = (val, True, virtual_clock.get_time(), virtual_clock.get_time(), temp[4])
+                if self.write_site(site, transaction, val, targets):
                     success_count += 1
-                else:
-                    temp = site.vars[self.name]['transaction_snapshots'][transaction]
-                    site.vars[self.name]['transaction_snapshots'][transaction] = (temp[0], temp[1], temp[2], virtual_clock.get_time(), temp[4])
-                    # print(site.vars[self.name]['transaction_snapshots'][transaction])
-            if success_count >= 1:  # write should succeed for at-least one site
+            return self.record_write_result(success_count)
+
+        def write_site(self, site, transaction, val, targets, now=None):
+            """
+            Update the snapshot of the transaction at one site for a write of val.
+            If the site is one of the targets the value is written, if the site is down only the attempt time is updated.
+            :param targets: the sites the write goes to, see write_sites.
+            :param now: time of the write, a new tick is taken if None (a batch of writes shares one tick per site).
+            :return: whether the value was written at the site
+            """
+            snapshots = site.vars[self.name]['transaction_snapshots']
+            temp = snapshots[transaction]
+            if site in targets:
+                # value, whether site was updated since T began, update time, update attempt time, read blocked for that transaction
+                updated_at = virtual_clock.get_time() if now is None else now
+                attempted_at = virtual_clock.get_time() if now is None else now
+                snapshots[transaction] = (val, True, updated_at, attempted_at, temp[4])
+                return True
+            elif site.status == DataManager.STATUS_DOWN:
+                attempted_at = virtual_clock.get_time() if now is None else now
+                snapshots[transaction] = (temp[0], temp[1], temp[2], attempted_at, temp[4])
+            return False
+
+        def record_write_result(self, success_count):
+            """
+            Set last_write_success from the number of sites a write went to: at least one with available copies,
+            at least write_quorum in quorum mode. Prints why the commit will fail otherwise.
+            """
+            self.last_write_success = False
+            if self.uses_quorum() and success_count < self.write_quorum:
+                print("Transaction commit will fail as only {}/{} sites were up, write quorum is {}".format(success_count, len(self.sites), self.write_quorum))
+            elif success_count >= 1:  # write should succeed for at-least one site
                 self.last_write_success = True
             else:
                 print("Transaction commit will fail as only {}/{} sites were up".format(success_count, len(self.sites)))
@@ -134,6 +229,8 @@ class DataManager:
                                        "transaction_snapshots": {}}
             :param recovery_history: when was the site last recovered. Initially all sites are recovered at the start time.
             :param failure_history: add the time to this list when the site failed.
+            Both histories only grow with the virtual clock, so they are sorted and are searched with bisect
+            by the availability methods below instead of being scanned.
             """
             self.idx = str(idx)
             self.status = status
@@ -147,6 +244,39 @@ class DataManager:
             """
             return "Site(idx={}, status={}, vars={})".format(self.idx, self.status, self.vars)
 
+        def last_recovery(self, at=None):
+            """
+            Time of the last recovery (or creation) of the site at or before time at, or the last one if at is None.
+            None if the site did not exist yet.
+            """
+            i = len(self.recovery_history) if at is None else bisect.bisect_right(self.recovery_history, at)
+            return self.recovery_history[i - 1] if i else None
+
+        def last_failure(self, at=None):
+            """
+            Time of the last failure of the site at or before time at, or the last one if at is None. 0 if it never failed.
+            """
+            i = len(self.failure_history) if at is None else bisect.bisect_right(self.failure_history, at)
+            return self.failure_history[i - 1] if i else 0
+
+        def failed_since(self, t):
+            """
+            Whether the site failed after time t.
+            """
+            return self.last_failure() > t
+
+        def up_during(self, t1, t2=None):
+            """
+            Whether the site was continuously up over [t1, t2], or from t1 until now if t2 is None.
+            The site is up at t1 if it recovered after its last failure before t1, and it stays up if there
+            is no failure in (t1, t2].
+            """
+            recovered = self.last_recovery(t1)
+            if recovered is None or self.last_failure(t1) > recovered:
+                return False
+            i = bisect.bisect_right(self.failure_history, t1)
+            return i == len(self.failure_history) or (t2 is not None and self.failure_history[i] > t2)
+
         def fail(self):
             """
             Site class fail method. When the site fails we add that time to the failure history list of that particular site.
@@ -173,6 +303,19 @@ class DataManager:
         :param variables_map: dictionary of variable name with initalised correct variable.
         :param sites_map: dictionary of site index with initalised sites.
         :param transactions_map: In the datamanager class have a dictionary of all transaction names with the transaction
+        :param replication_mode: available copies (default) or quorum consensus for replicated variables.
+        :param read_quorum: read quorum R in quorum mode.
+        :param write_quorum: write quorum W in quorum mode.
+        :param pending_propagations: queue of replica updates still to be applied in quorum mode.
+        :param queued_propagations: number of updates queued by commits since the last propagate_pending.
+        :param placement: decides which sites hold a variable, see placement.py.
+        :param pending_migrations: names of the variables whose replicas still have to be moved by a rebalance.
+        :param leaving_sites: sites being removed, they keep serving until all their variables are moved.
+        :param catch_up_enabled: whether recovered sites catch up with a peer instead of waiting for new commits.
+        :param catch_ups: CatchUp state of the recovered sites that are still catching up, by site index.
+        :param blocked_reads: wait queue of the blocked reads, transaction name -> {variable name: time it blocked}.
+        :param read_timeout: number of virtual ticks a read can stay blocked before its transaction is aborted,
+        None to wait until the transaction ends.
         """
         self.x1 = self.Var(1)
         self.x2 = self.Var(2)
@@ -213,6 +356,22 @@ class DataManager:
         self.variables_map = {v.name: v for v in self.variables}
         self.sites_map = {s.idx: s for s in self.sites}
         self.transactions_map = {}
+        self.replication_mode = self.REPLICATION_AVAILABLE_COPIES
+        self.read_quorum = None
+        self.write_quorum = None
+        self.pending_propagations = collections.deque()
+        self.propagation_batch_size = 2  # well below N - W, so that propagation is spread over later operations
+        self.queued_propagations = 0
+        self.placement = DefaultPlacement()
+        self.pending_migrations = collections.deque()
+        self.rebalance_batch_size = 5
+        self.leaving_sites = []
+        self.catch_up_enabled = False
+        self.catch_ups = {}
+        self.catch_up_buckets = 4
+        self.catch_up_batch_size = 2
+        self.blocked_reads = collections.OrderedDict()
+        self.read_timeout = None
 
     def initialize(self):
         """
@@ -228,17 +387,299 @@ class DataManager:
             var.sites = self.get_sites(var.idx)
             for site in var.sites:
                 site.vars[var.name] = {"val": var.idx * 10, "committed_at": virtual_clock.get_time(), "uncommitted_at": None,
-                                       "transaction_snapshots": {}}
+                                       "version": 0, "transaction_snapshots": {}, "transaction_versions": {}}
 
-    def get_sites(self, idx):
+    def configure_replication(self, mode, read_quorum=None, write_quorum=None):
         """
-        If index is even then the get site has to return all sites.
-        If index is odd then only one site has that variable, so return the correct site.
+        Switch replication of the replicated (even) variables between available copies and quorum consensus.
+        In quorum mode a write goes to write_quorum replicas and a read picks the freshest of read_quorum replicas,
+        the remaining replicas are brought up to date in the background by propagate_pending.
+        Both quorums default to a majority of the replicas, and read_quorum + write_quorum must exceed the number of
+        replicas so that every read quorum sees the latest committed write.
         """
-        if idx % 2 == 0:
-            return self.sites
+        if mode == self.REPLICATION_AVAILABLE_COPIES:
+            read_quorum = write_quorum = None
+        elif mode == self.REPLICATION_QUORUM:
+            n = self.replica_count()
+            read_quorum = read_quorum if read_quorum is not None else n // 2 + 1
+            write_quorum = write_quorum if write_quorum is not None else n // 2 + 1
+            self.validate_quorums(read_quorum, write_quorum, n)
         else:
-            return [self.sites[idx % 10]]
+            raise ValueError("Unknown replication mode {}".format(mode))
+        self.replication_mode = mode
+        self.read_quorum = read_quorum
+        self.write_quorum = write_quorum
+        for var in self.variables:
+            var.read_quorum = read_quorum
+            var.write_quorum = write_quorum
+
+    @staticmethod
+    def validate_quorums(read_quorum, write_quorum, n):
+        """
+        Raise a ValueError unless both quorums are between 1 and n and read_quorum + write_quorum > n.
+        """
+        if not (1 <= read_quorum <= n and 1 <= write_quorum <= n):
+            raise ValueError("Quorums must be between 1 and {}".format(n))
+        if read_quorum + write_quorum <= n:
+            raise ValueError("R + W must be greater than the number of replicas ({} + {} <= {})".format(read_quorum, write_quorum, n))
+
+    def check_placement_quorums(self):
+        """
+        In quorum mode, check that the quorums still hold for the number of replicas the placement gives.
+        Called before a topology or placement change is rebalanced, so that it can be undone.
+        """
+        if self.replication_mode == self.REPLICATION_QUORUM:
+            n = max(len(self.get_sites(var.idx)) for var in self.variables if var.idx % 2 == 0)
+            self.validate_quorums(self.read_quorum, self.write_quorum, n)
+
+    def propagate_pending(self, limit=None):
+        """
+        Background propagation for quorum mode. Applies up to limit queued (variable, site, value, version) updates
+        to replicas that were not part of the write quorum. The default limit is propagation_batch_size, or the number
+        of updates queued since the last call if that is more, so that the queue does not grow under a sustained
+        write load.
+        Updates for sites that are down stay in the queue, and an update is dropped if the replica already has the
+        same or a newer version.
+        """
+        limit = max(self.propagation_batch_size, self.queued_propagations) if limit is None else limit
+        self.queued_propagations = 0
+        deferred = []
+        applied = 0
+        while self.pending_propagations and applied < limit:
+            var_name, site_idx, val, version = self.pending_propagations.popleft()
+            site = self.sites_map.get(site_idx)
+            if site is None or var_name not in site.vars:
+                # the replica was moved away by a rebalance, it copied the freshest value already
+                continue
+            if site.status == self.STATUS_DOWN:
+                deferred.append((var_name, site_idx, val, version))
+                continue
+            if site.vars[var_name]['version'] < version:
+                site.vars[var_name]['val'] = val
+                site.vars[var_name]['version'] = version
+                site.vars[var_name]['committed_at'] = virtual_clock.get_time()
+                applied += 1
+        self.pending_propagations.extend(deferred)
+
+    def get_sites(self, idx):
+        """
+        Sites that should hold variable idx according to the placement. By default if index is even
+        then the get site has to return all sites, if index is odd then only one site has that variable.
+        Sites that are being removed are not considered.
+        """
+        return self.placement.get_sites(idx, [site for site in self.sites if site not in self.leaving_sites])
+
+    def replica_count(self):
+        """
+        Number of copies of a replicated variable (N for quorum consensus).
+        """
+        return max(len(var.sites) for var in self.variables if var.idx % 2 == 0)
+
+    def run_background(self):
+        """
+        Background work done between operations: replica propagation for quorum mode, rebalance migrations
+        and catch-up of recovered sites. It runs in bounded steps when a transaction begins and when a site recovers,
+        never inside a commit.
+        """
+        self.propagate_pending()
+        self.rebalance_step()
+        self.catch_up_step()
+
+    def is_current(self, site, var_name):
+        """
+        A replica is current when its site never failed, or a write was committed to it since the last recovery.
+        Only current replicas of replicated variables can be read (see Var.read_var).
+        """
+        return site.last_failure() == 0 or site.vars[var_name]['committed_at'] > site.last_recovery()
+
+    def start_catch_up(self, site):
+        """
+        Register a recovered site for catch-up. All its replicated variables that are not current are pending.
+        """
+        pending_vars = [var_name for var_name in site.vars
+                        if len(self.variables_map[var_name].sites) > 1 and not self.is_current(site, var_name)]
+        if pending_vars:
+            self.catch_ups[site.idx] = CatchUp(site, pending_vars, self.catch_up_buckets)
+
+    def find_catch_up_peer(self, catch_up):
+        """
+        Peer to compare a catching up site with: an up site that is not catching up itself,
+        holding current copies of most of the pending variables.
+        """
+        best, best_count = None, 0
+        for site in self.sites:
+            if site is catch_up.site or site.status != self.STATUS_UP or site.idx in self.catch_ups:
+                continue
+            count = sum(1 for var_name in catch_up.pending_vars if var_name in site.vars and self.is_current(site, var_name))
+            if count > best_count:
+                best, best_count = site, count
+        return best
+
+    def catch_up_step(self, limit=None):
+        """
+        Anti-entropy for recovered sites. For every catching up site, up to limit (default catch_up_batch_size)
+        buckets of its pending variables are compared with a peer. Buckets with the same digest on both sites
+        are current already, in the other buckets only the variables with a newer version at the peer are copied.
+        The checked variables are marked readable, as if a write had been committed to them.
+        Variables that got a committed write in the meantime are readable already and are just dropped.
+        """
+        limit = self.catch_up_batch_size if limit is None else limit
+        for site_idx, catch_up in list(self.catch_ups.items()):
+            site = catch_up.site
+            if site.status != self.STATUS_UP or site_idx not in self.sites_map:
+                del self.catch_ups[site_idx]
+                continue
+            catch_up.pending_vars = {var_name for var_name in catch_up.pending_vars
+                                     if var_name in site.vars and not self.is_current(site, var_name)}
+            peer = self.find_catch_up_peer(catch_up)
+            if peer is not None:
+                shared = [var_name for var_name in catch_up.pending_vars if var_name in peer.vars and self.is_current(peer, var_name)]
+                digests = bucket_digests(site, shared, catch_up.buckets)
+                peer_digests = bucket_digests(peer, shared, catch_up.buckets)
+                for bucket in sorted(digests)[:limit]:
+                    copied = 0
+                    for var_name in shared:
+                        if bucket_of(var_name, catch_up.buckets) != bucket:
+                            continue
+                        details, peer_details = site.vars[var_name], peer.vars[var_name]
+                        if digests[bucket] != peer_digests[bucket] and details['version'] < peer_details['version']:
+                            details['val'] = peer_details['val']
+                            details['version'] = peer_details['version']
+                            copied += 1
+                        details['committed_at'] = virtual_clock.get_time()
+                        catch_up.pending_vars.discard(var_name)
+                    if copied:
+                        print("Site {} caught up {} variable(s) from site {}".format(site_idx, copied, peer.idx))
+            if not catch_up.pending_vars:
+                del self.catch_ups[site_idx]
+
+    def configure_placement(self, placement):
+        """
+        Replace the placement strategy and start a rebalance towards it.
+        In quorum mode the placement is rejected with a ValueError if the quorums do not hold for its number of replicas.
+        """
+        previous, self.placement = self.placement, placement
+        try:
+            self.check_placement_quorums()
+        except ValueError:
+            self.placement = previous
+            raise
+        self.rebalance()
+
+    def add_site(self, idx):
+        """
+        Add a new, empty and up site to the cluster. The variables that the placement now puts on it are
+        streamed to it by the rebalance, transactions keep running meanwhile.
+        In quorum mode the site is rejected with a ValueError if R + W would no longer exceed the number of replicas.
+        """
+        if str(idx) in self.sites_map:
+            raise ValueError("Site {} already exists".format(idx))
+        site = self.Site(idx, self.STATUS_UP)
+        self.sites.append(site)
+        try:
+            self.check_placement_quorums()
+        except ValueError:
+            self.sites.remove(site)
+            raise
+        self.sites_map[site.idx] = site
+        self.rebalance()
+
+    def remove_site(self, idx):
+        """
+        Remove a site from the cluster. The site keeps serving its variables until the rebalance has moved
+        them to their new sites, then it is dropped.
+        """
+        site = self.sites_map[str(idx)]
+        if site in self.leaving_sites:
+            return
+        if len(self.sites) - len(self.leaving_sites) <= 1:
+            raise ValueError("Cannot remove the last site")
+        self.leaving_sites.append(site)
+        try:
+            self.check_placement_quorums()
+        except ValueError:
+            self.leaving_sites.remove(site)
+            raise
+        self.rebalance()
+
+    def rebalance(self):
+        """
+        Queue every variable whose current sites differ from the sites given by the placement.
+        Only these variables are moved, by rebalance_step, a few at a time.
+        """
+        for var in self.variables:
+            if var.name not in self.pending_migrations and self.get_sites(var.idx) != var.sites:
+                self.pending_migrations.append(var.name)
+        self.rebalance_step()
+
+    def finish_rebalance(self):
+        """
+        Run the rebalance until nothing is left to move, or until the variables left have no replica to copy from.
+        """
+        while self.pending_migrations:
+            if not self.rebalance_step(len(self.pending_migrations)):
+                break
+
+    def rebalance_step(self, limit=None):
+        """
+        Move up to limit (default rebalance_batch_size) variables of the pending rebalance to their new sites.
+        A variable without an up and current replica to copy from goes back to the end of the queue.
+        Once nothing is left, sites that are being removed and no longer hold any variable are dropped.
+        :return: number of variables moved
+        """
+        limit = self.rebalance_batch_size if limit is None else limit
+        moved = 0
+        for _ in range(min(limit, len(self.pending_migrations))):
+            var = self.variables_map[self.pending_migrations.popleft()]
+            new_sites = self.get_sites(var.idx)
+            if new_sites == var.sites:
+                continue
+            if self.migrate_var(var, new_sites):
+                moved += 1
+            else:
+                self.pending_migrations.append(var.name)
+        if not self.pending_migrations:
+            for site in list(self.leaving_sites):
+                if not site.vars:
+                    self.leaving_sites.remove(site)
+                    self.sites.remove(site)
+                    del self.sites_map[site.idx]
+                    print("Site {} removed".format(site.idx))
+        return moved
+
+    def migrate_var(self, var, new_sites):
+        """
+        Copy a variable to the sites that gained it and drop it from the sites that lost it.
+        The source is the up and current replica (see is_current) with the highest version, a single copy only
+        has to be up. The copy takes the committed value and version, and the snapshots of the running transactions
+        so they can go on reading and writing the variable at its new sites. A transaction that wrote the variable
+        keeps its write, whichever old replica recorded it. The copy counts as a committed write to the new replica,
+        so it is readable right away.
+        :return: False if there is no replica to copy from, nothing is changed then
+        """
+        sources = [site for site in var.sites if site.status == self.STATUS_UP
+                   and (len(var.sites) == 1 or self.is_current(site, var.name))]
+        if not sources:
+            return False
+        source = max(sources, key=lambda site: site.vars[var.name]['version'])
+        details = source.vars[var.name]
+        snapshots = dict(details['transaction_snapshots'])
+        for site in var.sites:
+            for transaction, snapshot in site.vars[var.name]['transaction_snapshots'].items():
+                current = snapshots.get(transaction, (None, False))
+                if snapshot[1] and not (current[1] and current[2] >= snapshot[2]):
+                    snapshots[transaction] = snapshot
+        for site in new_sites:
+            if site not in var.sites:
+                site.vars[var.name] = {"val": details['val'], "committed_at": virtual_clock.get_time(), "uncommitted_at": None,
+                                       "version": details['version'],
+                                       "transaction_snapshots": dict(snapshots),
+                                       "transaction_versions": dict(details['transaction_versions'])}
+        for site in var.sites:
+            if site not in new_sites:
+                del site.vars[var.name]
+        var.sites = new_sites
+        return True
 
     def handle_fail_site(self, site):
         # print(self.sites_map)
@@ -254,26 +695,72 @@ class DataManager:
         """
         for site in self.sites:
             print("Site {} - ".format(site.idx), end='')
-            print(", ".join(var + ": " + str(details['val']) for var, details in site.vars.items()))
+            print(", ".join(var + ": " + str(details['val']) for var, details in sorted(site.vars.items(), key=lambda item: int(item[0][1:]))))
 
 
     def handle_recover_site(self, site):
         """
         This function first calls the recover method associated with the site class.
-        Then it iterates over all sites to find what transactions have been read blocked because of 
-        no site being up (even variables) and unblocks them to avoid aborting the transaction if they have not ended
+        Then it retries the reads that have been blocked because of no site being up. The reads it can serve now are
+        unblocked, to avoid aborting their transaction if it has not ended; the others stay blocked.
+        """
+        recovered = self.sites_map[site]
+        recovered.recover()
+        if self.catch_up_enabled:
+            self.start_catch_up(recovered)
+        self.run_background()
+        self.retry_blocked_reads(recovered)
+
+    def block_read(self, transaction, varName):
+        """
+        Put a read that could not be served in the wait queue.
         """
-        self.sites_map[site].recover()
-        # unblock all even variables reads that were blocked because of all failed sites
-        change = False
+        self.blocked_reads.setdefault(transaction, {})[varName] = virtual_clock.time
+
+    def retry_blocked_reads(self, site):
+        """
+        Retry the queued reads of the variables hosted by a recovered site. Reads that can be served now
+        are unblocked in the snapshots of their transaction, print their value and leave the queue,
+        the others keep waiting.
+        """
+        for transaction, reads in list(self.blocked_reads.items()):
+            for varName in list(reads):
+                if varName not in site.vars:
+                    continue
+                var = self.variables_map[varName]
+                served, val = var.try_read_var(self.transactions_map[transaction])
+                if served:
+                    del reads[varName]
+                    for var_site in var.sites:
+                        temp = var_site.vars[varName]['transaction_snapshots'][transaction]
+                        var_site.vars[varName]['transaction_snapshots'][transaction] = (temp[0], temp[1], temp[2], temp[3], False)
+                    print("The blocked read is now unblocked for transaction")
+                    print("Blocked read of {} by {} retried, read value result: {}".format(varName, transaction, val))
+            if not reads:
+                del self.blocked_reads[transaction]
+
+    def get_expired_reads(self):
+        """
+        Queued reads that have waited more than read_timeout ticks, as (transaction name, variable name).
+        """
+        if self.read_timeout is None:
+            return []
+        return [(transaction, varName) for transaction, reads in self.blocked_reads.items()
+                for varName, blocked_at in reads.items() if virtual_clock.time - blocked_at > self.read_timeout]
+
+    def release_transaction(self, transaction):
+        """
+        Drop everything the data manager holds for an aborted transaction: its snapshots on every site,
+        its queued reads and its dependency graph entries.
+        """
+        self.transactions_map.pop(transaction, None)
+        self.blocked_reads.pop(transaction, None)
         for site in self.sites:
             for _, var in site.vars.items():
-                for transaction in var['transaction_snapshots']:
-                    temp = var['transaction_snapshots'][transaction]
-                    var['transaction_snapshots'][transaction] = (temp[0], temp[1], temp[2], temp[3], False)
-                    change = True
-        if change:
-            print("The blocked read is now unblocked for transaction")
+                var['transaction_snapshots'].pop(transaction, None)
+                var['transaction_versions'].pop(transaction, None)
+        dependency_graph.nodes.pop(transaction, None)
+        dependency_graph.edges = {edge for edge in dependency_graph.edges if transaction not in edge[:2]}
 
     def register_transaction_write(self, transaction, varName, value):
         # self.variables_map[varName].uncommitted_vals["uncommitted_" + transaction] = value
@@ -282,11 +769,45 @@ class DataManager:
         """
         self.variables_map[varName].write_var(transaction, value)
 
+    def register_transaction_writes(self, transaction, writes):
+        """
+        Batched version of register_transaction_write. Instead of walking the sites of every variable separately,
+        every site is visited once and all the variables of the batch that it hosts are updated with a single clock tick.
+        The snapshots are updated with Var.write_site like Var.write_var does, so the outcome is the same as writing
+        the variables one by one.
+        :param writes: dict of variable name to value
+        """
+        success_counts = {varName: 0 for varName in writes}
+        targets = {varName: self.variables_map[varName].write_sites() for varName in writes}
+        for site in self.sites:
+            hosted = [varName for varName in writes if varName in site.vars]
+            if not hosted:
+                continue
+            now = virtual_clock.get_time()
+            for varName in hosted:
+                if self.variables_map[varName].write_site(site, transaction, writes[varName], targets[varName], now):
+                    success_counts[varName] += 1
+        for varName, success_count in success_counts.items():
+            self.variables_map[varName].record_write_result(success_count)
+
     def register_transaction_read(self, transaction, varName):
         """
         It prints the value read by the transaction when executing.
         """
-        print("Read value result: {}".format(self.variables_map[varName].read_var(transaction)))
+        served, val = self.variables_map[varName].read_var(transaction)
+        print("Read value result: {}".format(val))
+        if not served:
+            self.block_read(transaction.name, varName)
+
+    def register_transaction_reads(self, transaction, varNames):
+        """
+        Batched version of register_transaction_read, prints the value read for every variable.
+        """
+        results = [(varName, *self.variables_map[varName].read_var(transaction)) for varName in varNames]
+        for varName, served, _ in results:
+            if not served:
+                self.block_read(transaction.name, varName)
+        print("Read value result: {}".format(", ".join("{}: {}".format(varName, val) for varName, _, val in results)))
     
     def register_transaction_begin(self, transaction):
         """
@@ -302,9 +823,11 @@ class DataManager:
             if site.status == DataManager.STATUS_UP:
                 for _, var in site.vars.items():
                     var['transaction_snapshots'][transaction.name] = (var['val'], False, virtual_clock.get_time(), virtual_clock.get_time(), False)
+                    var['transaction_versions'][transaction.name] = var['version']
             else:
                 for _, var in site.vars.items():
                     var['transaction_snapshots'][transaction.name] = (None, False, None, None, False)
+                    var['transaction_versions'][transaction.name] = None
 
     def get_last_commits(self):
         """
@@ -370,8 +893,7 @@ class DataManager:
         Iterate over all variables. For every variable iterate over the sites it is on.
         Cases:
         Case 1. For the conflict about site failing after a transaction attempts to write to it and ends after the fail.
-        We check for every failure of the site and 
-        if it happened after the transaction attempted to write to it, we abort the transaction.
+        We check if the site failed after the transaction attempted to write to it, if so we abort the transaction.
         Case 2. We first check if the current transaction snapshot for that variable has an associated write.
         That means that the current transaction has attempted to write on that variable in its course.
         we check if for the variable the last seen commit is same as the variable's committed version of the transaction.
@@ -381,7 +903,8 @@ class DataManager:
         of failed sites, and even if it recovered no one wrote to it, we abort the transaction.
 
         Then we exit the loop. For the last case we have to check if the serialization graph has a cycle.
-        Case 4. We call the dependency graph class function to check the cycle and pass the transaction name, logs and map.
+        Case 4. In quorum mode, a replicated variable written by the transaction has to have reached a write quorum.
+        Case 5. We call the dependency graph class function to check the cycle and pass the transaction name, logs and map.
         If will create cycle function returns True we abort the transaction with the cycle reason.
 
         If none of the cases are True, we update the value of the variable, the committed at becomes the new time
@@ -390,15 +913,15 @@ class DataManager:
         outcome = True
         conflicts = []
 
-        # if transaction.read_even_blocked:
-        #     return False, ["Aborted because no site has a committed write to read the variable being read"]
+        if self.blocked_reads.get(transaction.name):
+            # a read of the transaction is still waiting in the queue, it was never served
+            return False, ["Aborted because no site has a committed write to read the variable being read"]
 
         for v in self.variables:
             for site in v.sites:
-                for failure in site.failure_history:
-                    if site.vars[v.name]['transaction_snapshots'][transaction.name][1] and failure > site.vars[v.name]['transaction_snapshots'][transaction.name][3]:
-                        # print(failure, v.name, site.vars[v.name]['transaction_snapshots'][transaction.name])
-                        return False, ['site failed after a write']
+                if site.vars[v.name]['transaction_snapshots'][transaction.name][1] and site.failed_since(site.vars[v.name]['transaction_snapshots'][transaction.name][3]):
+                    # print(v.name, site.vars[v.name]['transaction_snapshots'][transaction.name])
+                    return False, ['site failed after a write']
                 if site.vars[v.name]['transaction_snapshots'][transaction.name][1]:
                     if v.committed_version != 'initial' and transaction.last_seen_commits[v.name] == v.committed_version.name:
                         continue
@@ -409,6 +932,10 @@ class DataManager:
                             conflicts.append((v.name, v.committed_version.name, 'committed first'))
                 if site.vars[v.name]['transaction_snapshots'][transaction.name][4]:
                     return False, ["Aborted because no site has a committed write to read the variable being read"]
+            if v.uses_quorum():
+                written = sum(1 for site in v.sites if site.vars[v.name]['transaction_snapshots'][transaction.name][1])
+                if 0 < written < v.write_quorum:
+                    return False, ["Aborted because the write to {} reached {}/{} replicas".format(v.name, written, v.write_quorum)]
         
         if not outcome:
             return False, conflicts
@@ -429,12 +956,22 @@ class DataManager:
             
             for v in self.variables:
                 # transaction_uncommited_val = v.uncommitted_vals.get("uncommitted_" + transaction.name, None)
-                for site in v.sites:
-                    if site.vars[v.name]['val'] != site.vars[v.name]['transaction_snapshots'][transaction.name][0] and site.vars[v.name]['transaction_snapshots'][transaction.name][1]:
+                written_sites = [site for site in v.sites if site.vars[v.name]['transaction_snapshots'][transaction.name][1]]
+                if written_sites:
+                    v.version += 1
+                for site in written_sites:
+                    site.vars[v.name]['version'] = v.version
+                    if site.vars[v.name]['val'] != site.vars[v.name]['transaction_snapshots'][transaction.name][0]:
                         site.vars[v.name]['val'] = site.vars[v.name]['transaction_snapshots'][transaction.name][0]
                         site.vars[v.name]['committed_at'] = virtual_clock.get_time()
                         v.committed_version = transaction
                         # print(v.name,transaction.name, site.vars[v.name])
+                if written_sites and v.uses_quorum():
+                    for site in v.sites:
+                        if site not in written_sites:
+                            self.pending_propagations.append((v.name, site.idx, written_sites[0].vars[v.name]['val'], v.version))
+                            self.queued_propagations += 1
+            # the other replicas are updated later by run_background, the commit only pays for the write quorum
 
             return True, conflicts
 
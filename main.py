@@ -1,72 +1,179 @@
+import argparse
 import re
 import sys
 
 from datamanager import database
+from placement import ConsistentHashPlacement
 from transaction_manager import TransactionManager
 
 
+re_comments = re.compile("//")
+re_begin  = re.compile("begin\s*\(+(?P<arg>\w+)\s*\)")
+re_R = re.compile("R\(\s*(?P<transaction>\w+)\s*,\s*(?P<var>\w+)\s*\)")
+re_W = re.compile("W\(\s*(?P<transaction>\w+)\s*,\s*(?P<var>\w+)\s*,\s*(?P<arg>\w+)\s*\)")
+re_MR = re.compile("MR\(\s*(?P<transaction>\w+)\s*,(?P<vars>\s*\w+\s*(,\s*\w+\s*)*)\)")
+re_MW = re.compile("MW\(\s*(?P<transaction>\w+)\s*,(?P<args>\s*\w+\s*=\s*\w+\s*(,\s*\w+\s*=\s*\w+\s*)*)\)")
+re_recover = re.compile("recover\s*\(+(?P<arg>\w+)\s*\)")
+re_fail = re.compile("fail\s*\(+(?P<arg>\w+)\s*\)")
+re_end = re.compile("end\s*\(+(?P<arg>\w+)\s*\)")
+re_addsite = re.compile("addsite\s*\(+(?P<arg>\w+)\s*\)")
+re_removesite = re.compile("removesite\s*\(+(?P<arg>\w+)\s*\)")
+re_dump = re.compile("dump\s*\(\s*\)\s*")
+
+# call the class
+transaction_manager = TransactionManager(database)
+
+
+def parse_command(line):
+    """
+    Parse one line of the input language.
+    :return: (command, arguments). MR arguments are (transaction, [variables]) and MW arguments are
+    (transaction, {variable: value}). Comments give "comment", empty lines "empty" and anything else "unexpected".
+    """
+    line = line.strip()
+    # line = line.replace(" ", "")
+    if re_comments.match(line):
+        return "comment", (line,)
+    elif re_begin.match(line):
+        return "begin", (re_begin.match(line).group("arg"),)
+    elif re_R.match(line):
+        return "R", (re_R.match(line).group("transaction"), re_R.match(line).group("var"))
+    elif re_W.match(line):
+        return "W", (re_W.match(line).group("transaction"), re_W.match(line).group("var"), re_W.match(line).group("arg"))
+    elif re_MR.match(line):
+        variables = [v.strip() for v in re_MR.match(line).group("vars").split(",")]
+        return "MR", (re_MR.match(line).group("transaction"), variables)
+    elif re_MW.match(line):
+        writes = {}
+        for arg in re_MW.match(line).group("args").split(","):
+            variable, value = arg.split("=")
+            writes[variable.strip()] = value.strip()
+        return "MW", (re_MW.match(line).group("transaction"), writes)
+    elif re_recover.match(line):
+        return "recover", (re_recover.match(line).group("arg"),)
+    elif re_fail.match(line):
+        return "fail", (re_fail.match(line).group("arg"),)
+    elif re_end.match(line):
+        return "end", (re_end.match(line).group("arg"),)
+    elif re_addsite.match(line):
+        return "addsite", (re_addsite.match(line).group("arg"),)
+    elif re_removesite.match(line):
+        return "removesite", (re_removesite.match(line).group("arg"),)
+    elif re_dump.match(line):
+        return "dump", ()
+    elif line is None or line == '':
+        return "empty", ()
+    else:
+        return "unexpected", (line,)
+
+
+def execute_command(line):
+    """
+    Execute one line of the input language against the transaction manager and the database.
+    """
+    command, args = parse_command(line)
+    if command == "comment":
+        print("ignoring comment --", args[0])
+    elif command == "begin":
+        print("Begin transaction --", args[0])
+        transaction_manager.handle_begin_transaction(args[0])
+    elif command == "R":
+        transaction, variable = args
+        print("Transaction -- ", transaction, "Read value of --", variable)
+        transaction_manager.handle_read(transaction, variable)
+    elif command == "W":
+        transaction, variable, value = args
+        transaction_manager.handle_write(transaction, variable, value)
+        print("Transaction -- ", transaction, "Write value to --", variable, ": ", value)
+    elif command == "MR":
+        transaction, variables = args
+        print("Transaction -- ", transaction, "Read values of --", ", ".join(variables))
+        transaction_manager.handle_multi_read(transaction, variables)
+    elif command == "MW":
+        transaction, writes = args
+        transaction_manager.handle_multi_write(transaction, writes)
+        print("Transaction -- ", transaction, "Write values to --", ", ".join("{}: {}".format(v, val) for v, val in writes.items()))
+    elif command == "recover":
+        print("Recover site --", args[0])
+        database.handle_recover_site(args[0])
+    elif command == "fail":
+        print("Fail site --", args[0])
+        database.handle_fail_site(args[0])
+    elif command == "end":
+        print("End transaction --", args[0])
+        transaction_manager.handle_end_transaction(args[0])
+    elif command == "addsite":
+        print("Add site --", args[0])
+        try:
+            database.add_site(args[0])
+        except ValueError as e:
+            print("Site {} not added: {}".format(args[0], e))
+    elif command == "removesite":
+        print("Remove site --", args[0])
+        try:
+            database.remove_site(args[0])
+        except ValueError as e:
+            print("Site {} not removed: {}".format(args[0], e))
+    elif command == "dump":
+        print("Dump")
+        database.dump()
+    elif command == "empty":
+        print("Empty line, ignored")
+    else:
+        print("Unexpected input", args[0])
+        # break
+
+
 def parse_input(file_name):
-    re_comments = re.compile("//")
-    re_begin  = re.compile("begin\s*\(+(?P<arg>\w+)\s*\)")
-    re_R = re.compile("R\(\s*(?P<transaction>\w+)\s*,\s*(?P<var>\w+)\s*\)")
-    re_W = re.compile("W\(\s*(?P<transaction>\w+)\s*,\s*(?P<var>\w+)\s*,\s*(?P<arg>\w+)\s*\)")
-    re_recover = re.compile("recover\s*\(+(?P<arg>\w+)\s*\)")
-    re_fail = re.compile("fail\s*\(+(?P<arg>\w+)\s*\)")
-    re_end = re.compile("end\s*\(+(?P<arg>\w+)\s*\)")
-    re_dump = re.compile("dump\s*\(\s*\)\s*")
     try:
         with open(file_name, 'r') as f:
             for line in f.readlines():
-                line = line.strip()
-                # line = line.replace(" ", "")
-                if re_comments.match(line):
-                    print("ignoring comment --", line)
-                elif re_begin.match(line):
-                    print("Begin transaction --", re_begin.match(line).group("arg"))
-                    transaction_manager.handle_begin_transaction(re_begin.match(line).group("arg"))
-                elif re_R.match(line):
-                    transaction = re_R.match(line).group("transaction")
-                    variable = re_R.match(line).group("var")
-                    print("Transaction -- ", transaction, "Read value of --", variable)
-                    transaction_manager.handle_read(transaction, variable)
-                elif re_W.match(line):
-                    transaction_manager.handle_write(re_W.match(line).group("transaction"), re_W.match(line).group("var"),  re_W.match(line).group("arg"))
-                    print("Transaction -- ", re_W.match(line).group("transaction"), "Write value to --", re_W.match(line).group("var"), ": ", re_W.match(line).group("arg"))
-                elif re_recover.match(line):
-                    site = re_recover.match(line).group("arg")
-                    print("Recover site --", site)
-                    database.handle_recover_site(site)
-
-                elif re_fail.match(line):
-                    site = re_fail.match(line).group("arg")
-                    print("Fail site --", site)
-                    database.handle_fail_site(site)
-
-                elif re_end.match(line):
-                    print("End transaction --", re_end.match(line).group("arg"))
-                    transaction_manager.handle_end_transaction(re_end.match(line).group("arg"))
-                elif re_dump.match(line):
-                    print("Dump")
-                    database.dump()
-                elif line is None or line == '':
-                    print("Empty line, ignored")
-                else:
-                    print("Unexpected input", line)
-                    # break
+                execute_command(line)
     except FileNotFoundError:
         print(f"The file {file_name} does not exist.")
     except Exception as e:
         print(f"An error occurred: {e}")
 
-if len(sys.argv) != 2:
-    print("Usage: python3 main.py <file name>")
-    sys.exit(1)
-# get the input file 
-file_name = sys.argv[1]
 
+def add_engine_arguments(arg_parser):
+    """
+    Command line options configuring the engine, shared by main.py and server.py
+    """
+    arg_parser.add_argument("--quorum", nargs=2, type=int, metavar=("R", "W"),
+                            help="use quorum consensus for replicated variables instead of available copies")
+    arg_parser.add_argument("--replication-factor", type=int, metavar="K",
+                            help="place variables on a consistent hash ring, with K copies of every replicated variable")
+    arg_parser.add_argument("--virtual-nodes", type=int, default=16, metavar="V",
+                            help="points per site on the consistent hash ring (default 16)")
+    arg_parser.add_argument("--catch-up", action="store_true",
+                            help="recovered sites catch up with a peer so replicated variables can be read before a new commit")
+    arg_parser.add_argument("--read-timeout", type=int, metavar="TICKS",
+                            help="abort a transaction whose read stays blocked for more than TICKS virtual clock ticks")
 
-# call the class
-transaction_manager = TransactionManager(database)
 
-# parse the input file
-parse_input(file_name)
+def configure_engine(args):
+    """
+    Apply the engine options to the database, exits on an invalid configuration.
+    """
+    database.catch_up_enabled = args.catch_up
+    database.read_timeout = args.read_timeout
+    try:
+        if args.replication_factor:
+            database.configure_placement(ConsistentHashPlacement(args.replication_factor, args.virtual_nodes))
+            database.finish_rebalance()
+        if args.quorum:
+            database.configure_replication(database.REPLICATION_QUORUM, *args.quorum)
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(usage="python3 main.py <file name> [--quorum R W] [--replication-factor K [--virtual-nodes V]] [--catch-up] [--read-timeout TICKS]")
+    arg_parser.add_argument("file_name")
+    add_engine_arguments(arg_parser)
+    args = arg_parser.parse_args()
+    configure_engine(args)
+
+    # parse the input file
+    parse_input(args.file_name)
@@ -0,0 +1,64 @@
+import bisect
+import hashlib
+
+
+def stable_hash(key):
+    """
+    hash() of a str is randomised per process, placement has to be the same on every run
+    """
+    return int(hashlib.md5(key.encode()).hexdigest(), 16)
+
+
+class DefaultPlacement:
+    """
+    Placement of the original design. Even (replicated) variables are on all sites,
+    odd variable i is only on site i % 10 + 1.
+    """
+    def get_sites(self, idx, sites):
+        if idx % 2 == 0:
+            return list(sites)
+        else:
+            return [sites[idx % len(sites)]]
+
+
+class ConsistentHashPlacement:
+    """
+    Places variables on a consistent hash ring. Every site owns virtual_nodes points of the ring, a variable is
+    stored on the first distinct sites found walking clockwise from the hash of its name:
+    replication_factor of them for even (replicated) variables, one for odd variables.
+    Adding or removing a site only moves the variables next to its points on the ring.
+    """
+    def __init__(self, replication_factor=3, virtual_nodes=16):
+        """
+        ConsistentHashPlacement constructor
+        :param replication_factor: number of copies of a replicated variable.
+        :param virtual_nodes: number of points per site on the ring.
+        :param _rings: cache of the ring for a given list of site ids.
+        """
+        if replication_factor < 1:
+            raise ValueError("Replication factor must be at least 1")
+        if virtual_nodes < 1:
+            raise ValueError("Number of virtual nodes must be at least 1")
+        self.replication_factor = replication_factor
+        self.virtual_nodes = virtual_nodes
+        self._rings = {}
+
+    def _ring(self, sites):
+        key = tuple(site.idx for site in sites)
+        if key not in self._rings:
+            points = sorted((stable_hash("{}#{}".format(site.idx, v)), i)
+                            for i, site in enumerate(sites) for v in range(self.virtual_nodes))
+            self._rings[key] = ([point[0] for point in points], [point[1] for point in points])
+        return self._rings[key]
+
+    def get_sites(self, idx, sites):
+        hashes, owners = self._ring(sites)
+        count = min(self.replication_factor if idx % 2 == 0 else 1, len(sites))
+        chosen = []
+        position = bisect.bisect(hashes, stable_hash("x" + str(idx)))
+        while len(chosen) < count:
+            owner = owners[position % len(owners)]
+            if owner not in chosen:
+                chosen.append(owner)
+            position += 1
+        return [sites[i] for i in sorted(chosen)]
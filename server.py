@@ -0,0 +1,102 @@
+"""
+Server mode: keeps one engine resident and serves the input language over a TCP or Unix socket.
+
+Protocol: a client sends commands one per line, the same as in an input file. A batch of commands ends with an
+empty line (or when the client closes its side). Batches can be pipelined, i.e. sent without waiting for
+the previous response. For every batch the server sends one response frame: a header line with the length of
+the payload in bytes, followed by the payload, which is everything the batch printed.
+Every batch is executed as a whole before any other batch, from any connection, so a batch is never interleaved
+with another one. Transaction and site names are shared by all connections.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+
+from main import add_engine_arguments, configure_engine, execute_command
+
+
+def execute_batch(lines):
+    """
+    Execute a batch of commands and return their output.
+    An error in one command is reported in the output and the rest of the batch still runs.
+    """
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        for line in lines:
+            try:
+                execute_command(line)
+            except Exception as e:
+                print(f"An error occurred: {e}")
+    return output.getvalue()
+
+
+def frame(payload):
+    data = payload.encode()
+    return str(len(data)).encode() + b"\n" + data
+
+
+async def handle_connection(reader, writer):
+    """
+    Read batches from a connection until it is closed, answering each one with a frame.
+    A batch with a line that cannot be read (not utf-8, or longer than the stream limit) is not executed,
+    its frame only holds the error.
+    """
+    batch = []
+    error = None
+    try:
+        while True:
+            try:
+                line = await reader.readline()
+                text = line.decode()
+            except (UnicodeDecodeError, ValueError, asyncio.LimitOverrunError) as e:
+                error = error or e
+                continue
+            if not line or not text.strip():
+                if error is not None:
+                    writer.write(frame(f"An error occurred: {error}\n"))
+                    await writer.drain()
+                elif batch:
+                    writer.write(frame(execute_batch(batch)))
+                    await writer.drain()
+                batch = []
+                error = None
+                if not line:
+                    break
+            else:
+                batch.append(text)
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+        with contextlib.suppress(ConnectionError):
+            await writer.wait_closed()
+
+
+async def serve(host=None, port=None, path=None):
+    """
+    Listen on a Unix socket if path is given, else on host:port.
+    """
+    if path:
+        server = await asyncio.start_unix_server(handle_connection, path=path)
+        print("Listening on {}".format(path))
+    else:
+        server = await asyncio.start_server(handle_connection, host=host, port=port)
+        print("Listening on {}:{}".format(host, port))
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(usage="python3 server.py [--host HOST] [--port PORT | --unix PATH] [engine options]")
+    arg_parser.add_argument("--host", default="127.0.0.1")
+    arg_parser.add_argument("--port", type=int, default=8765)
+    arg_parser.add_argument("--unix", metavar="PATH", help="listen on a Unix socket instead of TCP")
+    add_engine_arguments(arg_parser)
+    args = arg_parser.parse_args()
+    configure_engine(args)
+    try:
+        asyncio.run(serve(args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,224 @@
+"""
+Discrete-event simulation mode: predicts transaction latency and throughput for a replication and topology setting.
+
+The engine itself stays sequential and ordered by the VirtualClock. On top of it a scheduler keeps a simulated time
+in milliseconds: a number of clients each run transactions (begin, random reads and writes, end), issuing the next
+operation only when the previous one has completed in simulated time. An operation is applied to the engine when it
+is issued, and its completion time is computed from the sites it involves:
+- begin registers snapshots at every up site,
+- a read goes to the replica serving it (read_quorum replicas in quorum mode),
+- a write fans out to every site it is written to,
+- end validates at the transaction manager and applies the writes at every written site.
+Every request to a site pays a network delay both ways and waits in the FIFO queue of the site before its service
+time. A fan-out completes when its slowest site answers.
+"""
+
+import argparse
+import contextlib
+import heapq
+import io
+import random
+
+import main
+from datamanager import database
+
+
+class LatencyModel:
+    """
+    Latency distributions of a site: exponential network delay (each way) and service time, in milliseconds.
+    """
+    def __init__(self, network_ms, service_ms):
+        self.network_ms = network_ms
+        self.service_ms = service_ms
+
+    def network(self, rng):
+        return rng.expovariate(1 / self.network_ms) if self.network_ms > 0 else 0.0
+
+    def service(self, rng):
+        return rng.expovariate(1 / self.service_ms) if self.service_ms > 0 else 0.0
+
+    def __repr__(self):
+        return "LatencyModel(network_ms={}, service_ms={})".format(self.network_ms, self.service_ms)
+
+
+class Simulation:
+    """
+    Scheduler of the simulation. Events are (time, sequence, action) in a heap, sites are single server FIFO queues.
+    """
+    def __init__(self, latency_models, default_model, clients, ops_per_transaction, write_ratio,
+                 coordinator_ms, failure_rate, downtime_ms, seed):
+        """
+        Simulation constructor
+        :param latency_models: LatencyModel by site index, sites not in it use default_model.
+        :param clients: number of concurrent clients, each running one transaction at a time.
+        :param ops_per_transaction: number of reads and writes per transaction.
+        :param write_ratio: fraction of the operations that are writes.
+        :param coordinator_ms: time taken by the transaction manager to validate a commit.
+        :param failure_rate: site failures per simulated second, 0 for none.
+        :param downtime_ms: time a failed site stays down.
+        :param busy_until: time at which every site has served its queue.
+        :param latencies: (begin time, end time, committed) of every finished transaction.
+        """
+        self.latency_models = latency_models
+        self.default_model = default_model
+        self.clients = clients
+        self.ops_per_transaction = ops_per_transaction
+        self.write_ratio = write_ratio
+        self.coordinator_ms = coordinator_ms
+        self.failure_rate = failure_rate
+        self.downtime_ms = downtime_ms
+        self.random = random.Random(seed)
+        self.now = 0.0
+        self.events = []
+        self.sequence = 0
+        self.busy_until = {}
+        self.next_transaction = 1
+        self.latencies = []
+
+    def schedule(self, time, action):
+        heapq.heappush(self.events, (time, self.sequence, action))
+        self.sequence += 1
+
+    def model(self, site):
+        return self.latency_models.get(site.idx, self.default_model)
+
+    def request(self, site, sent_at=None):
+        """
+        Completion time of a request sent to a site at sent_at (default now): network, queueing, service and network back.
+        """
+        model = self.model(site)
+        arrival = (self.now if sent_at is None else sent_at) + model.network(self.random)
+        start = max(arrival, self.busy_until.get(site.idx, 0.0))
+        self.busy_until[site.idx] = start + model.service(self.random)
+        return self.busy_until[site.idx] + model.network(self.random)
+
+    def fan_out(self, sites, sent_at=None):
+        """
+        Completion time of requests sent in parallel to several sites at sent_at (default now).
+        """
+        sent_at = self.now if sent_at is None else sent_at
+        return max([self.request(site, sent_at) for site in sites], default=sent_at)
+
+    def read_sites(self, var):
+        up_sites = [site for site in var.sites if site.status == database.STATUS_UP]
+        if var.uses_quorum():
+            return up_sites[:var.read_quorum]
+        return up_sites[:1]
+
+    def written_sites(self, transaction):
+        return [site for site in database.sites for details in site.vars.values()
+                if details['transaction_snapshots'].get(transaction, (None, False))[1]]
+
+    def run_client(self, state):
+        """
+        Issue the next operation of a client and schedule the client again at its completion.
+        """
+        transaction_manager = main.transaction_manager
+        if state.get("transaction") is None:
+            state["transaction"] = "T{}".format(self.next_transaction)
+            self.next_transaction += 1
+            state["began_at"] = self.now
+            state["remaining"] = self.ops_per_transaction
+            transaction_manager.handle_begin_transaction(state["transaction"])
+            done = self.fan_out([site for site in database.sites if site.status == database.STATUS_UP])
+        elif state["remaining"] > 0:
+            state["remaining"] -= 1
+            var = self.random.choice(database.variables)
+            if self.random.random() < self.write_ratio:
+                done = self.fan_out(var.write_sites())
+                transaction_manager.handle_write(state["transaction"], var.name, self.random.randint(0, 1000))
+            else:
+                done = self.fan_out(self.read_sites(var))
+                transaction_manager.handle_read(state["transaction"], var.name)
+        else:
+            transaction = state["transaction"]
+            written = sorted(set(self.written_sites(transaction)), key=lambda site: int(site.idx))
+            transaction_manager.handle_end_transaction(transaction)
+            committed = transaction in transaction_manager.active_transactions and \
+                transaction_manager.active_transactions[transaction].state == "COMMITTED"
+            # the commit is sent to the sites once validated, the clock of the scheduler stays at the event time
+            validated_at = self.now + self.coordinator_ms
+            done = self.fan_out(written, validated_at) if committed else validated_at
+            self.latencies.append((state["began_at"], done, committed))
+            state["transaction"] = None
+        self.schedule(done, lambda: self.run_client(state))
+
+    def fail_site(self):
+        up_sites = [site for site in database.sites if site.status == database.STATUS_UP]
+        if len(up_sites) > 1:
+            site = self.random.choice(up_sites)
+            database.handle_fail_site(site.idx)
+            self.schedule(self.now + self.downtime_ms, lambda: database.handle_recover_site(site.idx))
+        self.schedule(self.now + self.random.expovariate(self.failure_rate / 1000), self.fail_site)
+
+    def run(self, transactions):
+        """
+        Run until the given number of transactions has finished.
+        """
+        for _ in range(self.clients):
+            state = {}
+            self.schedule(0.0, lambda state=state: self.run_client(state))
+        if self.failure_rate > 0:
+            self.schedule(self.random.expovariate(self.failure_rate / 1000), self.fail_site)
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            while self.events and len(self.latencies) < transactions:
+                self.now, _, action = heapq.heappop(self.events)
+                action()
+                output.seek(0)
+                output.truncate()
+
+    def report(self):
+        """
+        p50/p99 latency of the committed transactions and the committed throughput.
+        """
+        committed = sorted(end - begin for begin, end, ok in self.latencies if ok)
+        elapsed = max((end for _, end, _ in self.latencies), default=0.0)
+        lines = ["{} transactions, {} committed, {} aborted, {:.1f} ms simulated".format(
+            len(self.latencies), len(committed), len(self.latencies) - len(committed), elapsed)]
+        if committed:
+            lines.append("latency p50 {:.3f} ms, p99 {:.3f} ms".format(
+                percentile(committed, 50), percentile(committed, 99)))
+            lines.append("throughput {:.1f} committed transactions/s".format(len(committed) / elapsed * 1000 if elapsed else 0))
+        return lines
+
+
+def percentile(values, p):
+    """
+    Nearest-rank percentile of sorted values
+    """
+    rank = max(1, -(-len(values) * p // 100))
+    return values[int(rank) - 1]
+
+
+def parse_site_latency(value):
+    """
+    SITE=NETWORK_MS,SERVICE_MS
+    """
+    site, models = value.split("=")
+    network_ms, service_ms = models.split(",")
+    return site.strip(), LatencyModel(float(network_ms), float(service_ms))
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(usage="python3 simulation.py [--transactions N] [--clients C] [--site-latency SITE=NET,SERVICE ...] [engine options]")
+    arg_parser.add_argument("--transactions", type=int, default=1000, help="transactions to simulate (default 1000)")
+    arg_parser.add_argument("--clients", type=int, default=4, help="concurrent clients (default 4)")
+    arg_parser.add_argument("--ops-per-transaction", type=int, default=4)
+    arg_parser.add_argument("--write-ratio", type=float, default=0.5)
+    arg_parser.add_argument("--network-ms", type=float, default=0.5, help="mean network delay each way (default 0.5)")
+    arg_parser.add_argument("--service-ms", type=float, default=0.1, help="mean service time at a site (default 0.1)")
+    arg_parser.add_argument("--site-latency", type=parse_site_latency, action="append", default=[], metavar="SITE=NET,SERVICE",
+                            help="latency model of one site, can be repeated")
+    arg_parser.add_argument("--coordinator-ms", type=float, default=0.05, help="commit validation time (default 0.05)")
+    arg_parser.add_argument("--failure-rate", type=float, default=0.0, help="site failures per simulated second")
+    arg_parser.add_argument("--downtime-ms", type=float, default=100.0, help="time a failed site stays down")
+    arg_parser.add_argument("--seed", type=int, default=0)
+    main.add_engine_arguments(arg_parser)
+    args = arg_parser.parse_args()
+    main.configure_engine(args)
+
+    simulation = Simulation(dict(args.site_latency), LatencyModel(args.network_ms, args.service_ms), args.clients,
+                            args.ops_per_transaction, args.write_ratio, args.coordinator_ms, args.failure_rate,
+                            args.downtime_ms, args.seed)
+    simulation.run(args.transactions)
+    print("\n".join(simulation.report()))
@@ -0,0 +1,206 @@
+"""
+Soak mode: drives a continuous generated workload against the engine for a while and checks that its
+structures stay bounded.
+
+Every sample records the number of entries of each engine structure and the memory traced by tracemalloc for every
+engine source file. The memory is per file, not per structure: the structures allocated in the same file (e.g.
+active_transactions, transactions_map and the transaction logs) show the same figure. The counts are normalised by the number of live (begun, not ended) transactions.
+A structure fails the run if its normalised count keeps rising over the samples after the warm-up: its trend is
+the Kendall rank correlation of the counts with time, 1 if every sample is above all the earlier ones, around 0 for
+a structure that stays level, whatever the length of the run. A run fails if a trend is above --max-trend.
+"""
+
+import argparse
+import contextlib
+import io
+import random
+import sys
+import time
+import tracemalloc
+
+import main
+from DependencyGraph import dependency_graph
+from datamanager import database
+
+# structure -> source file that allocates its entries, whose tracemalloc figure is shown next to it
+STRUCTURE_MODULES = {
+    "active_transactions": "transaction_manager.py",
+    "transactions_map": "transaction_manager.py",
+    "transaction_snapshots": "datamanager.py",
+    "transaction_logs": "transaction_manager.py",
+    "dependency_graph_nodes": "DependencyGraph.py",
+    "dependency_graph_edges": "DependencyGraph.py",
+    "pending_propagations": "datamanager.py",
+}
+
+
+def structure_sizes():
+    """
+    Number of entries of every engine structure
+    """
+    active_transactions = main.transaction_manager.active_transactions
+    return {
+        "active_transactions": len(active_transactions),
+        "transactions_map": len(database.transactions_map),
+        "transaction_snapshots": sum(len(details['transaction_snapshots']) for site in database.sites for details in site.vars.values()),
+        "transaction_logs": sum(len(transaction.log) for transaction in active_transactions.values()),
+        "dependency_graph_nodes": len(dependency_graph.nodes),
+        "dependency_graph_edges": len(dependency_graph.edges),
+        "pending_propagations": len(database.pending_propagations),
+    }
+
+
+def module_memory():
+    """
+    Bytes currently traced by tracemalloc, by source file
+    """
+    memory = {}
+    for stat in tracemalloc.take_snapshot().statistics("filename"):
+        filename = stat.traceback[0].filename.replace("\\", "/").rsplit("/", 1)[-1]
+        memory[filename] = memory.get(filename, 0) + stat.size
+    return memory
+
+
+class Workload:
+    """
+    Random workload keeping about `concurrency` transactions live. Every step begins, reads, writes or ends a
+    transaction, and now and then fails or recovers a site.
+    """
+    def __init__(self, concurrency, ops_per_transaction, failure_rate, seed):
+        """
+        Workload constructor
+        :param concurrency: number of transactions kept live.
+        :param ops_per_transaction: average number of reads and writes per transaction.
+        :param failure_rate: probability of a site failure per step.
+        :param live: live transactions and the number of operations they still have to do.
+        :param failed_sites: sites that are down.
+        """
+        self.concurrency = concurrency
+        self.ops_per_transaction = ops_per_transaction
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.next_transaction = 1
+        self.live = {}
+        self.failed_sites = []
+        self.errors = 0
+
+    def next_command(self):
+        if len(self.live) < self.concurrency:
+            name = "T{}".format(self.next_transaction)
+            self.next_transaction += 1
+            self.live[name] = self.random.randint(1, 2 * self.ops_per_transaction)
+            return "begin({})".format(name)
+        roll = self.random.random()
+        if roll < self.failure_rate and len(self.failed_sites) < len(database.sites) - 1:
+            site = self.random.choice([site.idx for site in database.sites if site.idx not in self.failed_sites])
+            self.failed_sites.append(site)
+            return "fail({})".format(site)
+        if roll < 2 * self.failure_rate and self.failed_sites:
+            return "recover({})".format(self.failed_sites.pop(0))
+        name = self.random.choice(list(self.live))
+        if self.live[name] == 0:
+            del self.live[name]
+            return "end({})".format(name)
+        self.live[name] -= 1
+        var = self.random.choice(database.variables).name
+        if self.random.random() < 0.5:
+            return "R({},{})".format(name, var)
+        return "W({},{},{})".format(name, var, self.random.randint(0, 1000))
+
+    def step(self):
+        command = self.next_command()
+        try:
+            main.execute_command(command)
+        except Exception:
+            self.errors += 1
+
+
+def trend(values):
+    """
+    Kendall rank correlation of values with their order: 1 if they only rise, -1 if they only fall,
+    around 0 if they stay level or move at random. Ties count for neither.
+    """
+    pairs = len(values) * (len(values) - 1) // 2
+    if not pairs:
+        return 0.0
+    score = sum((later > earlier) - (later < earlier)
+                for i, earlier in enumerate(values) for later in values[i + 1:])
+    return score / pairs
+
+
+def growth_report(samples, warmup, max_trend):
+    """
+    Trend of the per live transaction size of every structure over all the samples after warm-up.
+    :return: (failed structures, report lines)
+    """
+    window = [sample for sample in samples if sample["elapsed"] >= warmup] or samples
+    first, last = window[0], window[-1]
+    failed = []
+    lines = ["{:<24}{:>10}{:>10}{:>10}{:>10}{:>14}".format("structure", "first", "last", "growth", "trend", "file KiB")]
+    for structure, module in STRUCTURE_MODULES.items():
+        ratios = [sample["sizes"][structure] / max(1, sample["live"]) for sample in window]
+        growth = ratios[-1] / ratios[0] if ratios[0] else (float("inf") if ratios[-1] else 1.0)
+        structure_trend = trend(ratios)
+        if structure_trend > max_trend:
+            failed.append(structure)
+        lines.append("{:<24}{:>10}{:>10}{:>10.2f}{:>10.2f}{:>14.1f}{}".format(
+            structure, first["sizes"][structure], last["sizes"][structure], growth, structure_trend,
+            last["memory"].get(module, 0) / 1024, "  GROWING" if structure in failed else ""))
+    return failed, lines
+
+
+def soak(duration, sample_interval, warmup, max_trend, workload):
+    """
+    Run the workload for duration seconds, sampling every sample_interval seconds.
+    :return: (failed structures, report lines)
+    """
+    tracemalloc.start()
+    samples = []
+    start = time.monotonic()
+    next_sample = start
+    steps = 0
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+        while time.monotonic() - start < duration:
+            workload.step()
+            steps += 1
+            if steps % 100 == 0:
+                output.seek(0)
+                output.truncate()
+            # a sample is only taken with all the transactions live, a transaction that just ended would
+            # otherwise make every structure look bigger per live transaction for that sample
+            if time.monotonic() >= next_sample and len(workload.live) == workload.concurrency:
+                samples.append({"elapsed": time.monotonic() - start, "live": len(workload.live),
+                                "sizes": structure_sizes(), "memory": module_memory()})
+                next_sample += sample_interval
+    if not samples or len(workload.live) == workload.concurrency:
+        samples.append({"elapsed": time.monotonic() - start, "live": len(workload.live),
+                        "sizes": structure_sizes(), "memory": module_memory()})
+    tracemalloc.stop()
+    failed, lines = growth_report(samples, warmup, max_trend)
+    lines.insert(0, "{} steps, {} transactions, {} samples, {} errors".format(
+        steps, workload.next_transaction - 1, len(samples), workload.errors))
+    return failed, lines
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(usage="python3 soak.py [--duration S] [--concurrency N] [engine options]")
+    arg_parser.add_argument("--duration", type=float, default=60, help="seconds to run (default 60)")
+    arg_parser.add_argument("--sample-interval", type=float, default=5, help="seconds between samples (default 5)")
+    arg_parser.add_argument("--warmup", type=float, default=5, help="seconds before the baseline sample (default 5)")
+    arg_parser.add_argument("--concurrency", type=int, default=5, help="live transactions (default 5)")
+    arg_parser.add_argument("--ops-per-transaction", type=int, default=4)
+    arg_parser.add_argument("--failure-rate", type=float, default=0.01, help="probability of a site failure per step")
+    arg_parser.add_argument("--max-trend", type=float, default=0.6,
+                            help="maximum trend of a structure per live transaction, from -1 to 1 (default 0.6)")
+    arg_parser.add_argument("--seed", type=int, default=0)
+    main.add_engine_arguments(arg_parser)
+    args = arg_parser.parse_args()
+    main.configure_engine(args)
+
+    failed, lines = soak(args.duration, args.sample_interval, args.warmup, args.max_trend,
+                         Workload(args.concurrency, args.ops_per_transaction, args.failure_rate, args.seed))
+    print("\n".join(lines))
+    if failed:
+        print("Soak test failed, unbounded growth in: {}".format(", ".join(failed)))
+        sys.exit(1)
+    print("Soak test passed")
@@ -8,20 +8,20 @@ class TransactionManager:
             READ = "read"
             BEGIN = "begin"
 
-            def __init__(self, transaction_identifier, op, variable=None, value=None):
+            def __init__(self, transaction_identifier, op, variable=None, value=None, timestamp=None):
                 """
                 TransactionLogEntry constructor
                 :param op: The operation (read, write, begin) in the transaction log.
                 :param variable: The variable that the transaction log is working with.
                 :param value: The value with the transaction log's operation
                 :param transaction_identifier: transaction name
-                :param timestamp: timestamp associated with the log.
+                :param timestamp: timestamp associated with the log. A new tick is taken unless a batch shares one.
                 """
                 self.op = op
                 self.variable = variable
                 self.value = value
                 self.transaction_identifier = transaction_identifier
-                self.timestamp = virtual_clock.get_time()
+                self.timestamp = timestamp if timestamp is not None else virtual_clock.get_time()
 
             def __repr__(self):
                 return "Log({}{}{})".format(self.transaction_identifier, self.variable, self.op)
@@ -56,6 +56,25 @@ class TransactionManager:
             """
             self.log.append(self.TransactionLogEntry(self.name, self.TransactionLogEntry.READ, variable))
 
+        def log_writes(self, writes):
+            """
+            Append one write log entry per variable of a batch. All entries of the batch share a single timestamp,
+            the logs are only ordered per variable so this is the same as logging the writes one after the other.
+            :param writes: dict of variable name to value
+            """
+            timestamp = virtual_clock.get_time()
+            self.log.extend(self.TransactionLogEntry(self.name, self.TransactionLogEntry.WRITE, variable, value, timestamp)
+                            for variable, value in writes.items())
+
+        def log_reads(self, variables):
+            """
+            Append one read log entry per variable of a batch, sharing a single timestamp (see log_writes).
+            :param variables: list of variable names
+            """
+            timestamp = virtual_clock.get_time()
+            self.log.extend(self.TransactionLogEntry(self.name, self.TransactionLogEntry.READ, variable, None, timestamp)
+                            for variable in variables)
+
         def log_begin(self):
             """
             Append a log entry to the log list parameter of Transaction. The log entry constructor requires transaction name,
@@ -73,10 +92,38 @@ class TransactionManager:
         :param data_manager: The data_manager class object associated here with this class object.
         :param active_transactions: when the transaction begins add all transactions here in the dict.
         :param states: unused debugging var
+        :param timed_out_transactions: transactions aborted because a blocked read timed out, their later commands are
+        ignored. A transaction leaves it at its end.
         """
         self.data_manager = data_manager
         self.active_transactions = {}
         self.states = {}
+        self.timed_out_transactions = set()
+
+    def expire_blocked_reads(self):
+        """
+        Abort the transactions whose blocked read waited longer than the read timeout of the data manager,
+        and release everything held for them.
+        """
+        for transaction, variable in self.data_manager.get_expired_reads():
+            if transaction not in self.active_transactions:
+                continue
+            print("Transaction {} aborted because its read of {} was blocked for more than {} ticks".format(
+                transaction, variable, self.data_manager.read_timeout))
+            self.active_transactions[transaction].state = "ABORTED"
+            del self.active_transactions[transaction]
+            self.data_manager.release_transaction(transaction)
+            self.timed_out_transactions.add(transaction)
+
+    def is_timed_out(self, transaction):
+        """
+        Expire the blocked reads first, then tell whether the transaction was aborted because of a timeout.
+        """
+        self.expire_blocked_reads()
+        if transaction in self.timed_out_transactions:
+            print("Transaction {} was aborted after a read timeout, ignored".format(transaction))
+            return True
+        return False
 
     def get_transaction_states(self):
         """
@@ -92,7 +139,10 @@ class TransactionManager:
         """
         Begin transaction function. It adds the new transaction to active_transactions.
         And this in turn calls the data manager with the register_transaction_begin function.
+        Pending background work of the data manager is done first, so that the snapshot of the new transaction sees it.
         """
+        self.expire_blocked_reads()
+        self.data_manager.run_background()
         self.active_transactions[transaction] = self.Transaction(transaction, self.data_manager.get_last_commits())
         self.active_transactions[transaction].log_begin()
         self.data_manager.register_transaction_begin(self.active_transactions[transaction])
@@ -105,6 +155,9 @@ class TransactionManager:
         should be committed or aborted. If the outcome to commit is True, the transaction state is made COMMITTED.
         Else it prints the abort transaction part.
         """
+        if self.is_timed_out(transaction):
+            self.timed_out_transactions.discard(transaction)
+            return
         outcome, committed_version = self.data_manager.attempt_transaction_commit(self.active_transactions[transaction], self.get_transaction_states())
         if outcome:
             self.active_transactions[transaction].state = "COMMITTED"
@@ -114,6 +167,7 @@ class TransactionManager:
         else:
             print(
                 "Transaction {} aborted because of conflict, {}".format(transaction, committed_version))
+        self.data_manager.blocked_reads.pop(transaction, None)
 
     def handle_read(self, transaction, variable):
         """
@@ -122,6 +176,8 @@ class TransactionManager:
         that transaction to this one.
         :return: None
         """
+        if self.is_timed_out(transaction):
+            return
         self.active_transactions[transaction].log_read(variable)
         self.data_manager.register_transaction_read(self.active_transactions[transaction], variable)
 
@@ -131,9 +187,31 @@ class TransactionManager:
         2. Add logs which will later help to check ww edges.
         3. register the write with database manager class that helps to add transaction snapshots, helping check write first logic.
         """
+        if self.is_timed_out(transaction):
+            return
         self.active_transactions[transaction].log_write(var, val)
         self.data_manager.register_transaction_write(transaction, var, val)
         # print(self.data_manager.variables)
 
+    def handle_multi_read(self, transaction, variables):
+        """
+        Batched version of handle_read, used by MR(T, x1, x2, ...).
+        The reads are logged in one step and then handed to the data manager together.
+        """
+        if self.is_timed_out(transaction):
+            return
+        self.active_transactions[transaction].log_reads(variables)
+        self.data_manager.register_transaction_reads(self.active_transactions[transaction], variables)
+
+    def handle_multi_write(self, transaction, writes):
+        """
+        Batched version of handle_write, used by MW(T, x1=v1, x2=v2, ...).
+        :param writes: dict of variable name to value, the writes are applied in the dict order.
+        """
+        if self.is_timed_out(transaction):
+            return
+        self.active_transactions[transaction].log_writes(writes)
+        self.data_manager.register_transaction_writes(transaction, writes)
+
     def handle_dump(self):
         pass